@@ -1,17 +1,71 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import os
+import sys
 from pathlib import Path
-from typing import Optional
+from typing import Optional, TextIO
 
 import click
 
 from promcat.core import (
     HeaderStyle,
-    collect_files,
+    TextFileCache,
     format_file_section,
     format_tree_section,
     generate_tree,
     get_path_specification,
+    iter_files,
+    read_text_file,
 )
 
+MAX_PENDING_FILES = 256
+
+
+def _load_and_format(
+    file_path: Path,
+    relative_path: str,
+    relative: bool,
+    style: HeaderStyle,
+    footer: bool,
+    line_numbers: bool,
+    separator: str,
+    cache: Optional[TextFileCache],
+) -> tuple[Optional[str], Optional[str]]:
+    """Read and format a single file, returning the section or an error message.
+
+    Binary files yield neither a section nor an error.
+    """
+    try:
+        content = read_text_file(file_path, cache)
+        if content is None:
+            return None, None
+
+        path_str = relative_path if relative else str(file_path)
+
+        formatted_section = format_file_section(
+            path_str,
+            content,
+            style,
+            include_footer=footer,
+            line_numbers=line_numbers,
+            number_separator=separator,
+        )
+        return formatted_section, None
+
+    except (IOError, UnicodeDecodeError) as e:
+        return None, f"Error reading {file_path}: {e}"
+
+
+def _write_result(future: concurrent.futures.Future, stream: TextIO) -> None:
+    """Write a finished section to the output, or report its error."""
+    formatted_section, error = future.result()
+    if error is not None:
+        click.echo(error, err=True)
+    elif formatted_section is not None:
+        stream.write(formatted_section)
+
 
 @click.command()
 @click.argument(
@@ -60,6 +114,12 @@ from promcat.core import (
     default=True,
     help="Include directory tree in the output",
 )
+@click.option(
+    "--cache",
+    "cache_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Directory for remembering binary files between runs (e.g. ~/.cache/promcat)",
+)
 def main(
     directory: Path,
     output: Optional[Path],
@@ -71,6 +131,7 @@ def main(
     line_numbers: bool,
     separator: str,
     tree: bool,
+    cache_dir: Optional[Path],
 ):
     """Concatenate all text files in a directory, optionally respecting .gitignore and .promcatignore"""
     ignore_files = []
@@ -80,45 +141,62 @@ def main(
         ignore_files.append(".promcatignore")
 
     path_specification = get_path_specification(directory, ignore_files)
+    header_style = HeaderStyle(style)
+    cache = TextFileCache.load(cache_dir) if cache_dir else None
+
+    load_and_format = functools.partial(
+        _load_and_format,
+        relative=relative,
+        style=header_style,
+        footer=footer,
+        line_numbers=line_numbers,
+        separator=separator,
+        cache=cache,
+    )
 
-    file_collection = collect_files(directory, path_specification)
-
-    result = []
-    for file_path in file_collection.text_files:
-        try:
-            path_str = (
-                str(file_path.relative_to(directory)) if relative else str(file_path)
-            )
-
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-
-            formatted_section = format_file_section(
-                path_str,
-                content,
-                HeaderStyle(style),
-                include_footer=footer,
-                line_numbers=line_numbers,
-                number_separator=separator,
-            )
-
-            result.append(formatted_section)
-
-        except (IOError, UnicodeDecodeError) as e:
-            click.echo(f"Error reading {file_path}: {e}", err=True)
-
-    if tree:
-        tree_representation = generate_tree(file_collection.all_files, directory)
-        formatted_tree = format_tree_section(tree_representation, HeaderStyle(style))
-        result.append(formatted_tree)
-
-    output_text = "".join(result)
+    if output:
+        sink = output.open("w", encoding="utf-8")
+        # The output file is created before the walk; keep it out of its own input.
+        exclude = [output]
+    else:
+        sink = contextlib.nullcontext(sys.stdout)
+        exclude = []
+
+    # The nested structure is only needed for the tree section.
+    tree_root = {} if tree else None
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with (
+        sink as stream,
+        concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor,
+    ):
+        # Files are read while the walk is still discovering the rest of the tree.
+        # Finished sections at the head of the queue are written out right away, and
+        # once too many files are in flight the walk waits for the oldest one, so at
+        # most MAX_PENDING_FILES sections are held in memory at a time.
+        futures = collections.deque()
+        for file_path, relative_path in iter_files(
+            directory, path_specification, tree=tree_root, exclude=exclude
+        ):
+            while futures and (len(futures) >= MAX_PENDING_FILES or futures[0].done()):
+                _write_result(futures.popleft(), stream)
+            futures.append(executor.submit(load_and_format, file_path, relative_path))
+
+        while futures:
+            _write_result(futures.popleft(), stream)
+
+        if tree:
+            tree_representation = generate_tree(tree_root)
+            formatted_tree = format_tree_section(tree_representation, header_style)
+            stream.write(formatted_tree)
+
+        if not output:
+            stream.write("\n")
+
+    if cache:
+        cache.save()
 
     if output:
-        output.write_text(output_text)
         click.echo(f"Output written to {output}")
-    else:
-        click.echo(output_text)
 
 
 if __name__ == "__main__":
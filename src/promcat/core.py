@@ -1,11 +1,25 @@
 import dataclasses
+import itertools
+import json
+import mmap
+import os
+import re
 from enum import Enum
 from pathlib import Path
-from typing import Iterable, Literal
+from typing import Callable, Iterable, Iterator, Literal
 import pathspec
 from loguru import logger
 
+try:
+    import re2
+except ImportError:
+    re2 = None
+
 DEFAULT_IGNORE_FILES = [".git", "uv.lock", "package-lock.json"]
+MMAP_THRESHOLD = 1 << 20  # bytes
+COMMON_IGNORED_DIRECTORIES = frozenset(
+    {".git", ".venv", "target", "node_modules", "__pycache__"}
+)
 
 
 class HeaderStyle(str, Enum):
@@ -43,6 +57,38 @@ def format_tree_section(tree: str, style: HeaderStyle) -> str:
     return tree
 
 
+def _render_newline_section(path: str, content: str, include_footer: bool) -> str:
+    return f"\n\n{content}"
+
+
+def _render_separator_section(path: str, content: str, include_footer: bool) -> str:
+    header = f"\n=== {'start ' if include_footer else ''}{path} ===\n"
+    footer = f"\n=== end {path} ===\n" if include_footer else ""
+    return f"{header}{content}{footer}"
+
+
+def _render_markdown_section(path: str, content: str, include_footer: bool) -> str:
+    if path.endswith(".py"):
+        header = f"\n# {'start ' if include_footer else ''}{path}\n"
+        footer = f"\n# end {path}\n" if include_footer else ""
+    else:
+        header = f"\n## {'start ' if include_footer else ''}{path}\n"
+        footer = f"\n## end {path}\n" if include_footer else ""
+    return f"{header}{content}{footer}"
+
+
+def _render_xml_section(path: str, content: str, include_footer: bool) -> str:
+    return f"\n<file>\n<path>{path}</path>\n<content>\n{content}\n</content>\n</file>"
+
+
+_FILE_SECTION_RENDERERS = {
+    HeaderStyle.NEWLINE: _render_newline_section,
+    HeaderStyle.SEPARATOR: _render_separator_section,
+    HeaderStyle.MARKDOWN: _render_markdown_section,
+    HeaderStyle.XML: _render_xml_section,
+}
+
+
 def format_file_section(
     path: str,
     content: str,
@@ -56,37 +102,145 @@ def format_file_section(
         add_line_numbers(content, number_separator) if line_numbers else content
     )
 
-    if style == HeaderStyle.NEWLINE:
-        return f"\n\n{formatted_content}"
-
-    elif style == HeaderStyle.SEPARATOR:
-        header = f"\n=== {'start ' if include_footer else ''}{path} ===\n"
-        footer = f"\n=== end {path} ===\n" if include_footer else ""
-        return f"{header}{formatted_content}{footer}"
-
-    elif style == HeaderStyle.MARKDOWN:
-        if path.endswith(".py"):
-            header = f"\n# {'start ' if include_footer else ''}{path}\n"
-            footer = f"\n# end {path}\n" if include_footer else ""
-        else:
-            header = f"\n## {'start ' if include_footer else ''}{path}\n"
-            footer = f"\n## end {path}\n" if include_footer else ""
-        return f"{header}{formatted_content}{footer}"
+    render = _FILE_SECTION_RENDERERS.get(style)
+    if render is None:
+        return formatted_content  # fallback case
 
-    elif style == HeaderStyle.XML:
-        return f"\n<file>\n<path>{path}</path>\n<content>\n{formatted_content}\n</content>\n</file>"
-
-    return formatted_content  # fallback case
+    return render(path, formatted_content, include_footer)
 
 
-def is_text_file(filepath: Path) -> bool:
+@dataclasses.dataclass
+class TextFileCache:
+    """Text detection results that persist between runs.
+
+    Entries are keyed by device, inode, modification time and size, so a file that
+    changes or is replaced is sniffed again. Storing a new entry for a file drops the
+    outdated one, so the cache can be shared between directory trees.
+    """
+
+    path: Path
+    entries: dict[str, bool] = dataclasses.field(default_factory=dict)
+    _keys_by_file: dict[str, str] = dataclasses.field(init=False, repr=False)
+
+    FILE_NAME = "text_sniff.json"
+
+    def __post_init__(self) -> None:
+        self._keys_by_file = {key.rsplit(":", 2)[0]: key for key in self.entries}
+
+    @classmethod
+    def load(cls, directory: Path) -> "TextFileCache":
+        path = directory / cls.FILE_NAME
+        try:
+            entries = json.loads(path.read_bytes())
+        except (OSError, ValueError):
+            entries = {}
+        if not isinstance(entries, dict):
+            entries = {}
+        return cls(path=path, entries=entries)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.entries), encoding="utf-8")
+
+    @staticmethod
+    def _key(stat: os.stat_result) -> str:
+        return f"{stat.st_dev}:{stat.st_ino}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def get(self, stat: os.stat_result) -> bool | None:
+        return self.entries.get(self._key(stat))
+
+    def set(self, stat: os.stat_result, is_text: bool) -> None:
+        key = self._key(stat)
+        outdated = self._keys_by_file.get(f"{stat.st_dev}:{stat.st_ino}")
+        if outdated is not None and outdated != key:
+            self.entries.pop(outdated, None)
+        self._keys_by_file[f"{stat.st_dev}:{stat.st_ino}"] = key
+        self.entries[key] = is_text
+
+
+def is_text_file(filepath: Path, cache: TextFileCache | None = None) -> bool:
     """Heuristically check if a file is likely a text file based on content sampling."""
+    stat = None
+    if cache is not None:
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return False
+        cached = cache.get(stat)
+        if cached is not None:
+            return cached
+        if stat.st_size == 0:
+            cache.set(stat, True)
+            return True
+
+    # Never ask for more than the file holds when its size is already known.
+    sample_size = 1024 if stat is None else min(stat.st_size, 1024)
+
+    # Raw file descriptors skip the buffered file object; O_BINARY matters on Windows.
+    try:
+        fd = os.open(filepath, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except OSError:
+        return False
     try:
-        with open(filepath, "rb") as f:
-            sample = f.read(1024)
-            return not bool(b"\x00" in sample)
-    except IOError:
+        sample = os.read(fd, sample_size)
+    except OSError:
         return False
+    finally:
+        os.close(fd)
+
+    is_text = b"\x00" not in sample
+    if stat is not None:
+        cache.set(stat, is_text)
+    return is_text
+
+
+def _decode_text(data: bytes | mmap.mmap) -> str:
+    text = str(data, "utf-8")
+    # Match the universal newline handling of text-mode reads.
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def read_text_file(filepath: Path, cache: TextFileCache | None = None) -> str | None:
+    """Read a file as UTF-8 text, or return None if it looks binary.
+
+    The binary check samples the same leading bytes as `is_text_file`, so callers that
+    need the content anyway only open the file once. With a cache, empty files and
+    files already known to be binary are not opened at all. Files larger than
+    `MMAP_THRESHOLD` are decoded straight from a memory map instead of being copied
+    into a bytes object first.
+    """
+    stat = None
+    if cache is not None:
+        stat = os.stat(filepath)
+        if cache.get(stat) is False:
+            return None
+        if stat.st_size == 0:
+            cache.set(stat, True)
+            return ""
+
+    with open(filepath, "rb") as f:
+        # The file may have changed since the stat above; only the open one counts.
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ""
+        if size > MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                is_text = mapped.find(b"\x00", 0, 1024) == -1
+                if stat is not None:
+                    cache.set(stat, is_text)
+                return _decode_text(mapped) if is_text else None
+
+        data = f.read()
+
+    # Search the leading bytes in place rather than slicing off a copy.
+    is_text = data.find(b"\x00", 0, 1024) == -1
+    if stat is not None:
+        cache.set(stat, is_text)
+    return _decode_text(data) if is_text else None
 
 
 def get_path_specification(
@@ -97,21 +251,31 @@ def get_path_specification(
     ignore_file_paths = [
         root_dir / ignore_file for ignore_file in ignore_specification_files
     ]
-    ignore_file_contents = [
-        path.read_text().splitlines() for path in ignore_file_paths if path.exists()
-    ]
-    ignore_files_lines = [line for lines in ignore_file_contents for line in lines]
+    ignore_files_lines = list(
+        itertools.chain.from_iterable(
+            path.read_bytes().decode("utf-8").splitlines()
+            for path in ignore_file_paths
+            if path.exists()
+        )
+    )
 
     for ignore_file in DEFAULT_IGNORE_FILES:
         if ignore_file not in ignore_files_lines and (root_dir / ignore_file).exists():
             logger.warning(
-                f"`{ignore_file}` not in ignore files, but `{ignore_file}` file exists in `{root_dir}`"
+                "`{0}` not in ignore files, but `{0}` file exists in `{1}`",
+                ignore_file,
+                root_dir,
             )
-        if ignore_defaults:
-            logger.info(f"Ignoring `{ignore_file}` file")
-            ignore_files_lines.append(ignore_file)
 
-    logger.debug(f"Path specification:\n{ignore_files_lines}")
+    if ignore_defaults:
+        logger.info(
+            "Ignoring {} files",
+            ", ".join(f"`{ignore_file}`" for ignore_file in DEFAULT_IGNORE_FILES),
+        )
+        ignore_files_lines.extend(DEFAULT_IGNORE_FILES)
+
+    # Only render the (possibly long) pattern list if debug logging is enabled.
+    logger.opt(lazy=True).debug("Path specification:\n{}", lambda: ignore_files_lines)
 
     return pathspec.PathSpec.from_lines("gitwildmatch", ignore_files_lines)
 
@@ -120,51 +284,217 @@ def get_path_specification(
 class FileCollection:
     all_files: list[Path]
     text_files: list[Path]
+    tree: dict = dataclasses.field(default_factory=dict)
+
+
+_NAMED_GROUP = re.compile(r"\(\?P<\w+>")
+# Leading literal characters of a pattern regex, not counting one that a quantifier
+# makes optional.
+_LITERAL_PREFIX = re.compile(r"\^((?:(?:\\\W|[\w/-])(?![*+?{]))*)")
+
+
+def _compile_path_matcher(
+    path_specification: pathspec.PathSpec,
+) -> Callable[[str], bool]:
+    """Return a predicate equivalent to `path_specification.match_file`.
+
+    PathSpec tries every pattern in turn for each path. Without negated patterns a
+    path is ignored as soon as any pattern matches, so the patterns can be merged into
+    a single alternation that the regex engine checks in one pass, using RE2 when the
+    optional `google-re2` package is installed. Negated patterns depend on the order
+    in which patterns match, so those specifications are matched by PathSpec itself.
+    Paths must use forward slashes.
+    """
+    patterns = [
+        pattern
+        for pattern in path_specification.patterns
+        if getattr(pattern, "include", None) is not None
+    ]
+    if not patterns:
+        return lambda path: False
+    if any(
+        not pattern.include or getattr(pattern, "regex", None) is None
+        for pattern in patterns
+    ):
+        return path_specification.match_file
+
+    flags = {pattern.regex.flags for pattern in patterns}
+    if len(flags) != 1:
+        return path_specification.match_file
+
+    # Named groups may repeat across patterns, which an alternation does not allow.
+    union = "|".join(
+        f"(?:{_NAMED_GROUP.sub('(?:', pattern.regex.pattern)})" for pattern in patterns
+    )
+    flags = flags.pop()
+    match = None
+    # RE2 matches in linear time without backtracking; it takes no flags.
+    if re2 is not None and flags == re.UNICODE:
+        try:
+            match = re2.compile(union).match
+        except re2.error:
+            pass
+    if match is None:
+        match = re.compile(union, flags).match
+    return lambda path: match(path) is not None
+
+
+def _negated_prefixes(path_specification: pathspec.PathSpec) -> list[str]:
+    """Return the literal leading path of every negated pattern.
+
+    Anything a negated pattern re-includes starts with its prefix. Unanchored patterns
+    such as `!keep.txt` may match at any depth and get the empty prefix.
+    """
+    prefixes = []
+    for pattern in path_specification.patterns:
+        if getattr(pattern, "include", None) is not False:
+            continue
+        regex = getattr(getattr(pattern, "regex", None), "pattern", None)
+        match = _LITERAL_PREFIX.match(regex) if isinstance(regex, str) else None
+        prefixes.append(re.sub(r"\\(.)", r"\1", match.group(1)) if match else "")
+    return prefixes
+
+
+def iter_files(
+    root_dir: Path,
+    path_specification: pathspec.PathSpec,
+    tree: dict | None = None,
+    exclude: Iterable[Path] = (),
+) -> Iterator[tuple[Path, str]]:
+    """Lazily yield all files in directory that are not ignored, in sorted order.
+
+    Each file comes with its path relative to `root_dir`, using forward slashes. If
+    `tree` is given, it is filled with the nested directory structure of the yielded
+    files as the walk goes, ready for `generate_tree`. Files in `exclude` are skipped
+    as if they were ignored.
+    """
+    is_ignored = _compile_path_matcher(path_specification)
+
+    # A negated pattern can re-include a file below an ignored directory (e.g.
+    # `build/**` followed by `!build/keep.txt`), so a directory is only pruned when
+    # no negated pattern can reach into it.
+    negated_prefixes = _negated_prefixes(path_specification)
+
+    def _may_reinclude(relative_dir: str) -> bool:
+        return any(
+            prefix.startswith(relative_dir) or relative_dir.startswith(prefix)
+            for prefix in negated_prefixes
+        )
+
+    # Directory names the specification ignores at any depth can be pruned by
+    # name alone, without running the matcher for every occurrence.
+    pruned_names = {
+        name
+        for name in COMMON_IGNORED_DIRECTORIES
+        if is_ignored(f"{name}/") and is_ignored(f"_/{name}/")
+    }
+
+    excluded_paths = {os.path.abspath(path) for path in exclude}
+    excluded_names = {os.path.basename(path) for path in excluded_paths}
+
+    def _walk(
+        dir_path: str, prefix: str, node: dict | None
+    ) -> Iterator[tuple[Path, str]]:
+        # Unreadable directories are skipped, as Path.rglob did.
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                relative_path = f"{prefix}{entry.name}/"
+                if not _may_reinclude(relative_path) and (
+                    entry.name in pruned_names or is_ignored(relative_path)
+                ):
+                    continue
+                child = None if node is None else {}
+                yield from _walk(entry.path, relative_path, child)
+                # Directories without any kept files do not show up in the tree.
+                if child:
+                    node[entry.name] = child
+                continue
+
+            if not entry.is_file():
+                continue
+
+            relative_path = f"{prefix}{entry.name}"
+            if is_ignored(relative_path):
+                continue
+
+            if (
+                entry.name in excluded_names
+                and os.path.abspath(entry.path) in excluded_paths
+            ):
+                continue
+
+            if node is not None:
+                node[entry.name] = None
+            yield Path(entry.path), relative_path
+
+    yield from _walk(str(root_dir), "", tree)
 
 
 def collect_files(
-    root_dir: Path, path_specification: pathspec.PathSpec
+    root_dir: Path,
+    path_specification: pathspec.PathSpec,
+    *,
+    need_all_files: bool = True,
+    cache: TextFileCache | None = None,
 ) -> FileCollection:
-    """Recursively collect all (text) files in directory."""
+    """Recursively collect all (text) files in directory.
+
+    Without `need_all_files`, only the text files are collected and `all_files` and
+    `tree` stay empty. A `cache` is consulted and updated for the text detection.
+    """
     all_files = []
     text_files = []
+    tree = {}
 
-    for path in sorted(root_dir.rglob("*")):
-        if not path.is_file():
-            continue
+    for path, _ in iter_files(
+        root_dir, path_specification, tree=tree if need_all_files else None
+    ):
+        if need_all_files:
+            all_files.append(path)
 
-        if path_specification.match_file(str(path.relative_to(root_dir))):
+        if not is_text_file(path, cache):
             continue
 
-        all_files.append(path)
+        text_files.append(path)
 
-        if not is_text_file(path):
-            continue
+    return FileCollection(all_files=all_files, text_files=text_files, tree=tree)
 
-        text_files.append(path)
 
-    return FileCollection(all_files=all_files, text_files=text_files)
+def generate_tree(tree: dict) -> str:
+    """Generate a tree representation of the files.
 
+    `tree` maps directory names to nested dicts and file names to None, as filled in
+    by `iter_files`. Entries are rendered in insertion order, which the walk keeps
+    sorted.
+    """
 
-def generate_tree(files: list[Path], root_dir: Path) -> str:
-    """Generate a tree representation of the files."""
-    tree = {}
-    for file in files:
-        parts = file.relative_to(root_dir).parts
-        current = tree
-        for part in parts[:-1]:
-            current = current.setdefault(part, {})
-        current.setdefault(parts[-1], {})
-
-    def build_tree(current: dict, prefix: str = "") -> str:
-        lines = []
-        entries = sorted(current.keys())
-        for i, key in enumerate(entries):
-            connector = "└── " if i == len(entries) - 1 else "├── "
-            lines.append(f"{prefix}{connector}{key}")
-            if isinstance(current[key], dict) and current[key]:
-                extension = "    " if i == len(entries) - 1 else "│   "
-                lines.append(build_tree(current[key], prefix + extension))
-        return "\n".join(lines)
-
-    return build_tree(tree)
+    def level(
+        current: dict, prefix: str
+    ) -> Iterator[tuple[str, dict | None, str, bool]]:
+        last = len(current) - 1
+        for i, (key, child) in enumerate(current.items()):
+            yield key, child, prefix, i == last
+
+    # Walk depth-first with an explicit stack, emitting every line exactly once.
+    lines = []
+    stack = [level(tree, "")]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+
+        key, child, prefix, is_last = entry
+        connector = "└── " if is_last else "├── "
+        lines.append(f"{prefix}{connector}{key}")
+        if child:
+            extension = "    " if is_last else "│   "
+            stack.append(level(child, prefix + extension))
+
+    return "\n".join(lines)
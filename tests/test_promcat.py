@@ -1,12 +1,21 @@
+import os
+
+import pathspec
 import pytest
+from click.testing import CliRunner
 
+from promcat.cli import main
 from promcat.core import (
+    _compile_path_matcher,
     is_text_file,
     collect_files,
     format_file_section,
+    generate_tree,
     HeaderStyle,
+    TextFileCache,
     add_line_numbers,
     get_path_specification,
+    read_text_file,
 )
 
 
@@ -32,6 +41,105 @@ def test_is_text_file_non_existent(tmp_path):
     assert is_text_file(non_existent_file) is False
 
 
+@pytest.mark.parametrize(
+    "file_content, expected_result",
+    [
+        (b"plain text", "plain text"),
+        (b"windows\r\nline endings\r\n", "windows\nline endings\n"),
+        ("h\u00e9llo".encode(), "h\u00e9llo"),
+        (b"\x00\x01\x02\x03", None),
+        (b"", ""),
+    ],
+)
+def test_read_text_file(tmp_path, file_content, expected_result):
+    file_path = tmp_path / "test_file"
+    file_path.write_bytes(file_content)
+    assert read_text_file(file_path) == expected_result
+
+
+def test_read_text_file_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr("promcat.core.MMAP_THRESHOLD", 4)
+
+    text_path = tmp_path / "text"
+    text_path.write_bytes("large\r\nh\u00e9llo\r\n".encode())
+    binary_path = tmp_path / "binary"
+    binary_path.write_bytes(b"large\x00binary")
+
+    assert read_text_file(text_path) == "large\nh\u00e9llo\n"
+    assert read_text_file(binary_path) is None
+
+
+def test_read_text_file_truncated_after_stat(tmp_path, monkeypatch):
+    monkeypatch.setattr("promcat.core.MMAP_THRESHOLD", 4)
+    file_path = tmp_path / "truncated"
+    file_path.write_text("large enough to be mapped")
+    stat = os.stat(file_path)
+    file_path.write_bytes(b"")
+
+    real_stat = os.stat
+    monkeypatch.setattr(
+        "promcat.core.os.stat",
+        lambda path, **kwargs: stat if path == file_path else real_stat(path, **kwargs),
+    )
+    cache = TextFileCache.load(tmp_path / "cache")
+    assert read_text_file(file_path, cache) == ""
+
+
+def test_empty_files_are_not_opened(tmp_path, monkeypatch):
+    empty_path = tmp_path / "empty"
+    empty_path.touch()
+    cache = TextFileCache.load(tmp_path / "cache")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("empty file was opened")
+
+    monkeypatch.setattr("promcat.core.open", fail, raising=False)
+    monkeypatch.setattr("promcat.core.os.open", fail)
+    assert read_text_file(empty_path, cache) == ""
+    assert is_text_file(empty_path, TextFileCache.load(tmp_path / "cache")) is True
+
+
+def test_text_file_cache(tmp_path):
+    binary_path = tmp_path / "binary"
+    binary_path.write_bytes(b"\x00\x01\x02\x03")
+    text_path = tmp_path / "text"
+    text_path.write_text("text")
+
+    cache = TextFileCache.load(tmp_path / "cache")
+    assert is_text_file(binary_path, cache) is False
+    assert read_text_file(text_path, cache) == "text"
+    cache.save()
+
+    cache = TextFileCache.load(tmp_path / "cache")
+    assert len(cache.entries) == 2
+    assert read_text_file(binary_path, cache) is None
+    assert is_text_file(text_path, cache) is True
+
+    # A changed file no longer matches its cache entry and is sniffed again, which
+    # replaces the outdated entry.
+    binary_path.write_text("now it is text")
+    assert is_text_file(binary_path, cache) is True
+    assert sorted(cache.entries.values()) == [True, True]
+
+    specification = pathspec.PathSpec.from_lines("gitwildmatch", ["cache/"])
+    files = collect_files(tmp_path, specification, cache=cache)
+    assert files.text_files == [binary_path, text_path]
+
+
+def test_text_file_cache_shared_between_trees(tmp_path):
+    cache_dir = tmp_path / "cache"
+    for name in ["first", "second"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "binary").write_bytes(b"\x00")
+        result = CliRunner().invoke(
+            main, [str(tmp_path / name), "--cache", str(cache_dir)]
+        )
+        assert result.exit_code == 0
+
+    # The second run keeps the entries of the first tree.
+    assert sorted(TextFileCache.load(cache_dir).entries.values()) == [False, False]
+
+
 def test_collect_text_files(tmp_path):
     # Create test directory structure
     (tmp_path / "dir1").mkdir()
@@ -47,6 +155,11 @@ def test_collect_text_files(tmp_path):
     assert "dir1/test1.txt" in files
     assert "dir1/test2.txt" in files
 
+    file_collection = collect_files(tmp_path, path_spec, need_all_files=False)
+    assert file_collection.all_files == []
+    assert file_collection.tree == {}
+    assert len(file_collection.text_files) == 2
+
     # Test with ignore pattern
     (tmp_path / ".gitignore").write_text(
         "*.txt\n.gitignore"
@@ -70,6 +183,8 @@ def test_collect_text_files(tmp_path):
         ("Just a single line", " | ", "1 | Just a single line"),
         ("", " | ", ""),
         ("Lorem\nipsum", " > ", "1 > Lorem\n2 > ipsum"),
+        ("Lorem\nipsum", " %s {} ", "1 %s {} Lorem\n2 %s {} ipsum"),
+        ("Lorem\r\nipsum\r\n", " | ", "1 | Lorem\n2 | ipsum"),
         (
             "\n".join([f"Many-a-line {i}" for i in range(1, 101)]),
             " | ",
@@ -168,3 +283,210 @@ build-anywhere
     assert "src/build-anywhere/file.txt" not in files, (
         "Non-root pattern should work with comments"
     )
+
+
+def test_ignored_directories_are_pruned(tmp_path):
+    root = tmp_path
+    (root / ".gitignore").write_text("node_modules/\n/build/\n.gitignore")
+
+    (root / "node_modules" / "pkg").mkdir(parents=True)
+    (root / "node_modules" / "pkg" / "index.js").write_text("root module")
+    (root / "web" / "node_modules").mkdir(parents=True)
+    (root / "web" / "node_modules" / "index.js").write_text("nested module")
+    (root / "web" / "app.js").write_text("app")
+    (root / "build").mkdir()
+    (root / "build" / "out.txt").write_text("root build output")
+    (root / "src" / "build").mkdir(parents=True)
+    (root / "src" / "build" / "keep.txt").write_text("nested build file")
+    (root / "src" / "node_modules").write_text("a file, not a directory")
+
+    path_spec = get_path_specification(root, [".gitignore"])
+    file_collection = collect_files(root, path_spec)
+    files = [str(f.relative_to(root)) for f in file_collection.all_files]
+
+    assert files == ["src/build/keep.txt", "src/node_modules", "web/app.js"]
+
+
+@pytest.mark.parametrize("max_pending_files", [1, 256])
+def test_cli_output_order(tmp_path, monkeypatch, max_pending_files):
+    monkeypatch.setattr("promcat.cli.MAX_PENDING_FILES", max_pending_files)
+
+    names = [f"file{i:02d}.txt" for i in range(40)]
+    for name in names:
+        (tmp_path / name).write_text(f"content of {name}")
+    (tmp_path / "binary.bin").write_bytes(b"\x00\x01\x02")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main, [str(tmp_path), "--style", "separator", "--no-line-numbers"]
+    )
+    assert result.exit_code == 0, result.output
+
+    positions = [result.output.index(f"=== start {name} ===") for name in names]
+    assert positions == sorted(positions)
+    assert "binary.bin ===" not in result.output
+    assert "└── file39.txt" in result.output
+
+
+def test_cli_output_file_excludes_itself(tmp_path):
+    (tmp_path / "a.txt").write_text("alpha")
+    output = tmp_path / "out.txt"
+
+    runner = CliRunner()
+    for _ in range(2):
+        result = runner.invoke(main, [str(tmp_path), "-o", str(output)])
+        assert result.exit_code == 0, result.output
+
+    written = output.read_text()
+    assert "alpha" in written
+    assert "out.txt" not in written
+
+
+def test_generate_tree(tmp_path):
+    for relative_path in [
+        "README.md",
+        "src/pkg/__init__.py",
+        "src/pkg/core.py",
+        "src/main.py",
+        "tests/test_core.py",
+    ]:
+        (tmp_path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / relative_path).write_text(relative_path)
+    (tmp_path / "empty").mkdir()
+
+    path_spec = get_path_specification(tmp_path, [])
+    file_collection = collect_files(tmp_path, path_spec)
+
+    assert generate_tree(file_collection.tree) == "\n".join(
+        [
+            "├── README.md",
+            "├── src",
+            "│   ├── main.py",
+            "│   └── pkg",
+            "│       ├── __init__.py",
+            "│       └── core.py",
+            "└── tests",
+            "    └── test_core.py",
+        ]
+    )
+
+
+MATCHER_PATHS = [
+    "a.txt",
+    "keep.txt",
+    "src/keep.txt",
+    "build/",
+    "build/out.bin",
+    "src/build/",
+    "node_modules/",
+    "web/node_modules/",
+    "node_modules",
+    "docs/guide.md",
+    "docs/api/index.md",
+    "README.md",
+]
+
+
+@pytest.mark.parametrize(
+    "patterns",
+    [
+        [],
+        ["*.txt", "/build", "node_modules/", "docs/**/*.md"],
+        ["*.txt", "!keep.txt"],
+    ],
+)
+def test_compiled_path_matcher_agrees_with_pathspec(monkeypatch, patterns):
+    monkeypatch.setattr("promcat.core.re2", None)
+    path_spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+    is_ignored = _compile_path_matcher(path_spec)
+
+    for path in MATCHER_PATHS:
+        assert is_ignored(path) == path_spec.match_file(path), path
+
+
+def test_re2_path_matcher_agrees_with_pathspec(monkeypatch):
+    re2 = pytest.importorskip("re2")
+    compiled = []
+    re2_compile = re2.compile
+
+    def recording_compile(pattern, *args, **kwargs):
+        compiled.append(pattern)
+        return re2_compile(pattern, *args, **kwargs)
+
+    monkeypatch.setattr(re2, "compile", recording_compile)
+
+    patterns = ["*.txt", "/build", "node_modules/", "docs/**/*.md", "*.py[cod]"]
+    path_spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+    is_ignored = _compile_path_matcher(path_spec)
+
+    assert compiled, "the combined pattern should be compiled with RE2"
+    for path in MATCHER_PATHS + ["pkg/module.pyc", "pkg/module.py"]:
+        assert is_ignored(path) == path_spec.match_file(path), path
+
+
+def test_unreadable_directories_are_skipped(tmp_path, monkeypatch):
+    (tmp_path / "locked").mkdir()
+    (tmp_path / "locked" / "secret.txt").write_text("secret")
+    (tmp_path / "open.txt").write_text("open")
+
+    scandir = os.scandir
+
+    def guarded_scandir(path):
+        if os.path.basename(path) == "locked":
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", guarded_scandir)
+
+    path_spec = get_path_specification(tmp_path, [])
+    file_collection = collect_files(tmp_path, path_spec)
+    files = [str(f.relative_to(tmp_path)) for f in file_collection.all_files]
+
+    assert files == ["open.txt"]
+
+
+@pytest.mark.parametrize(
+    "gitignore",
+    [
+        "build/**\n!build/keep.txt",
+        "build/\n!build/keep.txt",
+        "build\n!build/keep.txt",
+        "build/\n!keep.txt",
+    ],
+)
+def test_negated_patterns_reinclude_files_in_ignored_directories(tmp_path, gitignore):
+    root = tmp_path
+    (root / ".gitignore").write_text(gitignore + "\n.gitignore")
+    (root / "build").mkdir()
+    (root / "build" / "keep.txt").write_text("kept")
+    (root / "build" / "drop.txt").write_text("dropped")
+
+    path_spec = get_path_specification(root, [".gitignore"])
+    file_collection = collect_files(root, path_spec)
+    files = [str(f.relative_to(root)) for f in file_collection.all_files]
+
+    assert files == ["build/keep.txt"]
+
+
+def test_negated_patterns_keep_unrelated_directories_pruned(tmp_path, monkeypatch):
+    root = tmp_path
+    (root / ".gitignore").write_text("node_modules/\n.vscode/*\n!.vscode/settings.json")
+    (root / ".vscode").mkdir()
+    (root / ".vscode" / "settings.json").write_text("{}")
+    (root / "node_modules" / "pkg").mkdir(parents=True)
+    (root / "node_modules" / "pkg" / "index.js").write_text("")
+
+    scanned = []
+    real_scandir = os.scandir
+
+    def recording_scandir(path):
+        scanned.append(os.path.relpath(path, root))
+        return real_scandir(path)
+
+    monkeypatch.setattr("promcat.core.os.scandir", recording_scandir)
+    path_spec = get_path_specification(root, [".gitignore"], ignore_defaults=False)
+    file_collection = collect_files(root, path_spec)
+    files = [str(f.relative_to(root)) for f in file_collection.all_files]
+
+    assert files == [".gitignore", ".vscode/settings.json"]
+    assert scanned == [".", ".vscode"]